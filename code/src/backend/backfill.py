@@ -0,0 +1,248 @@
+import argparse
+import json
+import logging
+import mailbox
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from multiprocessing import get_context
+import numpy as np
+from classifier.llm_classifier import call_llm
+from config import EMBEDDING_MODEL, REQUEST_SUBREQUEST_MAP
+from data_preprocessing.text_extraction import EXTRACTION_ERROR_PREFIX, extract_text_from_source
+from database_lookup.database_check import (
+    add_embedding_columns,
+    bulk_insert_requests,
+    create_requests_table,
+    embed_texts,
+    fetch_labelled_embeddings,
+    fetch_loaded_source_ids,
+    fetch_requests_after,
+    provide_context,
+    reindex_requests_table,
+    update_request_embeddings,
+)
+
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".txt", ".msg", ".eml", ".email")
+
+
+def iter_source_items(source):
+    """
+    Yield (item_id, payload) for every supported file under a directory, or every message in an mbox.
+    Item ids are built from the resolved source path, so the same mailbox always gets the same ids.
+    """
+    source = os.path.realpath(source)
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith(SUPPORTED_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    yield path, path
+    else:
+        box = mailbox.mbox(source, create=False)
+        for key in box.iterkeys():
+            yield f"{source}:{key}", box.get_bytes(key)
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return {"reindex_last_id": 0}
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_checkpoint(path, checkpoint):
+    # Write to a temporary file first so an interrupted run never leaves a truncated checkpoint
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(checkpoint, file)
+    os.replace(tmp_path, path)
+
+
+def label_from_similar(embeddings, known_embeddings, known_labels, threshold):
+    """Return the label of the most similar known request for each embedding, or None below the threshold."""
+    if not known_labels:
+        return [None] * len(embeddings)
+
+    # Embeddings are normalized, so the dot product is the cosine similarity
+    scores = embeddings @ known_embeddings.T
+    best = scores.argmax(axis=1)
+    return [known_labels[j] if scores[i, j] >= threshold else None for i, j in enumerate(best)]
+
+
+def classify_unlabelled(model, texts, context, max_concurrency, max_retries=5):
+    """
+    Classify texts with the LLM, keeping at most max_concurrency calls in flight.
+    Rate limited calls wait for the advertised retry delay and are retried up to max_retries times.
+    """
+    def classify(text):
+        for attempt in range(max_retries + 1):
+            result = call_llm(model=model, text=text, allowed_types=REQUEST_SUBREQUEST_MAP, similar_cases=context, structured=True)
+            if "retry_after" not in result or attempt == max_retries:
+                return result
+            logging.warning(f"Rate limit exceeded. Retrying in {result['retry_after']} seconds.")
+            time.sleep(result["retry_after"])
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        return list(executor.map(classify, texts))
+
+
+def backfill(model, source, batch_size=500, workers=None, embed_batch_size=256,
+             llm_concurrency=4, threshold=0.7, few_shot=20, max_retries=5):
+    """
+    Load historical emails from a directory or mbox into the requests table.
+    Items are labelled from similar known requests where possible and by the LLM otherwise.
+    Every loaded row records its source id in the same transaction, so the table itself is the
+    checkpoint: a resumed run skips loaded items and retries everything else, including items
+    whose extraction or classification failed. Returns the number of items left pending.
+    """
+    # Spawn rather than fork the extraction workers so they never inherit the LLM client's gRPC state
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+        create_requests_table()
+        add_embedding_columns()
+
+        done = fetch_loaded_source_ids()
+
+        known_rows = fetch_labelled_embeddings()
+        known_labels = [(request_type, sub_request_type) for request_type, sub_request_type, _ in known_rows]
+        known_embeddings = np.array([embedding for _, _, embedding in known_rows], dtype=np.float32)
+
+        context = provide_context(model=model, mapping=REQUEST_SUBREQUEST_MAP, look_for_sample_dataset=True)
+        if isinstance(context, str):
+            raise RuntimeError(context)
+        context = context[:few_shot]
+
+        failed_extractions = 0
+        unclassified = 0
+        items = (item for item in iter_source_items(source) if item[0] not in done)
+        while True:
+            batch = list(islice(items, batch_size))
+            if not batch:
+                break
+
+            texts = pool.map(extract_text_from_source, [payload for _, payload in batch], chunksize=16)
+            extracted = []
+            for (item_id, _), text in zip(batch, texts):
+                if not text or text.startswith(EXTRACTION_ERROR_PREFIX):
+                    # Left out of the table so the next run retries it
+                    logging.warning(f"Skipping {item_id}: {text or 'no text extracted'}")
+                    failed_extractions += 1
+                else:
+                    extracted.append((item_id, text))
+
+            rows = []
+            if extracted:
+                embeddings = embed_texts([text for _, text in extracted], batch_size=embed_batch_size)
+                labels = label_from_similar(embeddings, known_embeddings, known_labels, threshold)
+
+                unlabelled = [i for i, label in enumerate(labels) if label is None]
+                results = classify_unlabelled(model, [extracted[i][1] for i in unlabelled], context, llm_concurrency, max_retries)
+                for i, result in zip(unlabelled, results):
+                    if "error" in result:
+                        # Left out of the table so the next run retries it
+                        logging.error(f"Classification failed for {extracted[i][0]}: {result}")
+                        unclassified += 1
+                    else:
+                        labels[i] = (result["request_type"], result["sub_request_type"])
+
+                labelled = [i for i, label in enumerate(labels) if label is not None]
+                rows = [(extracted[i][1], *labels[i], embeddings[i].tolist(), EMBEDDING_MODEL, extracted[i][0]) for i in labelled]
+                if rows and not bulk_insert_requests(rows):
+                    raise RuntimeError("Bulk load failed, stopping backfill. Rerun the same command to resume.")
+
+                if labelled:
+                    known_labels += [labels[i] for i in labelled]
+                    new_embeddings = embeddings[labelled]
+                    known_embeddings = np.vstack([known_embeddings, new_embeddings]) if known_embeddings.size else new_embeddings
+                done.update(extracted[i][0] for i in labelled)
+
+            logging.info(f"Batch done: {len(batch)} items read, {len(rows)} requests loaded, {len(done)} loaded in total.")
+
+    if failed_extractions or unclassified:
+        logging.warning(
+            f"{failed_extractions} items could not be extracted and {unclassified} could not be classified. "
+            "Rerun the same command to retry them."
+        )
+    else:
+        logging.info("Backfill finished, all items loaded.")
+    return failed_extractions + unclassified
+
+
+def reindex(checkpoint_path, batch_size=500, embed_batch_size=256):
+    """Recompute the embeddings of all stored requests with the current model and rebuild the indexes."""
+    add_embedding_columns()
+
+    checkpoint = load_checkpoint(checkpoint_path)
+    last_id = checkpoint["reindex_last_id"]
+
+    while True:
+        rows = fetch_requests_after(last_id, batch_size)
+        if not rows:
+            break
+
+        embeddings = embed_texts([text for _, text in rows], batch_size=embed_batch_size)
+        if not update_request_embeddings([(request_id, embedding.tolist()) for (request_id, _), embedding in zip(rows, embeddings)]):
+            raise RuntimeError("Embedding update failed, stopping reindex. Rerun to resume from the last checkpoint.")
+
+        last_id = rows[-1][0]
+        checkpoint["reindex_last_id"] = last_id
+        save_checkpoint(checkpoint_path, checkpoint)
+        logging.info(f"Reindexed requests up to id {last_id}.")
+
+    reindex_requests_table()
+    checkpoint["reindex_last_id"] = 0
+    save_checkpoint(checkpoint_path, checkpoint)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill historical emails into the requests table, or reindex stored embeddings.")
+    parser.add_argument("source", nargs="?", help="Directory of email/document files, or an mbox file")
+    parser.add_argument("--reindex", action="store_true", help="Recompute embeddings and indexes for stored requests")
+    parser.add_argument("--checkpoint", default="reindex_checkpoint.json", help="Checkpoint file used to resume --reindex")
+    parser.add_argument("--batch-size", type=int, default=500, help="Items extracted, embedded and loaded per batch")
+    parser.add_argument("--workers", type=int, default=None, help="Text extraction processes (default: CPU count)")
+    parser.add_argument("--embed-batch-size", type=int, default=256, help="Texts per embedding model forward pass")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="Maximum concurrent LLM calls")
+    parser.add_argument("--threshold", type=float, default=0.7, help="Similarity above which a known label is reused")
+    parser.add_argument("--few-shot", type=int, default=20, help="Number of context examples sent to the LLM")
+    parser.add_argument("--max-retries", type=int, default=5, help="Retries of a rate limited LLM call")
+    args = parser.parse_args(argv)
+    if not args.reindex and not args.source:
+        parser.error("source is required unless --reindex is given")
+    return args
+
+
+def main(argv=None):
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        handlers=[
+            logging.FileHandler("backfill.log"),
+            logging.StreamHandler()
+        ]
+    )
+    args = parse_args(argv)
+
+    if args.reindex:
+        reindex(args.checkpoint, batch_size=args.batch_size, embed_batch_size=args.embed_batch_size)
+        return
+
+    from models import gemini_llm  # Imported here so --reindex works without LLM credentials
+
+    backfill(
+        gemini_llm,
+        args.source,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        embed_batch_size=args.embed_batch_size,
+        llm_concurrency=args.llm_concurrency,
+        threshold=args.threshold,
+        few_shot=args.few_shot,
+        max_retries=args.max_retries,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ import re
 import json
 from langchain_core.messages import SystemMessage, HumanMessage
 import logging
+from classifier.structured_output import REQUIRED_FIELDS, stream_classification
 
 def format_few_shot_prompt(text, similar_cases):
     """Format past cases as few-shot learning examples."""
@@ -12,18 +13,25 @@ def format_few_shot_prompt(text, similar_cases):
     
     return f"{examples}\n\nNew Request:\n{text}\nClassify this request amongst the available request and sub request types told in beginning and provide value of request type, sub request type(empty string if not applicable) and reasoning in json format"
 
-def call_llm(model, text, allowed_types, similar_cases):
-    """Call LLM API with few-shot learning examples."""
+def call_llm(model, text, allowed_types, similar_cases, structured=False, required_fields=REQUIRED_FIELDS):
+    """
+    Call LLM API with few-shot learning examples.
+    With structured=True the answer is requested via a JSON schema and streamed,
+    returning as soon as the required_fields (request_type and sub_request_type by default) are complete.
+    """
     prompt = f"""
     Allowed request(keys), sub-request types(values) in the format of dictionary : {str(allowed_types)}
     """
     prompt += format_few_shot_prompt(text, similar_cases)
     
+    messages = [SystemMessage(content="You are an expert in classifying loan service requests."),
+                HumanMessage(content=prompt)]
+
     try:
-        response = model.invoke(
-            input=[SystemMessage(content="You are an expert in classifying loan service requests."),
-                   HumanMessage(content=prompt)]
-        )
+        if structured:
+            return stream_classification(model, messages, allowed_types, required_fields)
+
+        response = model.invoke(input=messages)
         result = re.search(r'\{\s*\"request_type\":.*?\}', response.content, re.DOTALL).group(0)
         response_dict = json.loads(result)
         return response_dict
@@ -0,0 +1,217 @@
+import json
+
+CLASSIFICATION_TOOL_NAME = "classify_request"
+REQUIRED_FIELDS = ("request_type", "sub_request_type")
+LITERAL_CHARS = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789+-.")
+
+
+def build_classification_schema(mapping):
+    """Build a JSON schema for the classification answer from the request/sub-request mapping."""
+    sub_request_types = sorted({sub for subs in mapping.values() for sub in subs})
+
+    # request_type and sub_request_type come first so streaming can stop before the reasoning
+    return {
+        "title": CLASSIFICATION_TOOL_NAME,
+        "description": "Classify a loan service request into one of the allowed request and sub request types.",
+        "type": "object",
+        "properties": {
+            "request_type": {"type": "string", "enum": list(mapping.keys())},
+            "sub_request_type": {
+                "type": "string",
+                "enum": sub_request_types + [""],
+                "description": "Empty string if not applicable.",
+            },
+            "reasoning": {"type": "string"},
+        },
+        "required": ["request_type", "sub_request_type", "reasoning"],
+    }
+
+
+def validate_classification(result, mapping):
+    """Check that the classification lies inside the allowed taxonomy, raising ValueError otherwise."""
+    request_type = result.get("request_type")
+    sub_request_type = result.get("sub_request_type") or ""
+
+    if request_type not in mapping:
+        raise ValueError(f"Request type {request_type!r} is not an allowed request type")
+    if sub_request_type and sub_request_type not in mapping[request_type]:
+        raise ValueError(f"Sub request type {sub_request_type!r} is not allowed for {request_type!r}")
+
+    result["sub_request_type"] = sub_request_type
+    return result
+
+
+class StreamingJSONParser:
+    """
+    Incrementally parses a JSON object fed in chunks and collects its top-level fields.
+    Text before the object, including prose with stray braces or quotes, is skipped:
+    a candidate object that turns out not to be valid JSON is abandoned and the scan
+    restarts just after its opening brace.
+    """
+
+    def __init__(self, required_fields=REQUIRED_FIELDS):
+        self.required_fields = required_fields
+        self.fields = {}
+        self._text = ""
+        self._pos = 0
+        self._start = None
+        self._state = None
+        self._buffer = []
+        self._escape = False
+        self._key = None
+        self._nested_depth = 0
+
+    @property
+    def complete(self):
+        return all(field in self.fields for field in self.required_fields)
+
+    def feed(self, text):
+        """Consume the next chunk of text and return True once all required fields are parsed."""
+        self._text += text
+        while self._pos < len(self._text) and not self.complete:
+            char = self._text[self._pos]
+            self._pos += 1
+            if self._start is None:
+                if char == "{":
+                    self._start, self._state = self._pos - 1, "key_or_end"
+            elif not self._step(char):
+                # Not a JSON object after all, rescan from just after its opening brace
+                self._pos = self._start + 1
+                self._abandon()
+        return self.complete
+
+    def _step(self, char):
+        """Advance the state machine of the current candidate object, returning False if it is invalid."""
+        state = self._state
+        if state in ("key", "string"):
+            if self._consume_string_char(char):
+                try:
+                    value = json.loads("".join(self._buffer), strict=False)
+                except ValueError:
+                    return False
+                if state == "key":
+                    self._key, self._state = value, "colon"
+                else:
+                    self._set_value(value)
+            return True
+        if state == "literal":
+            if char in LITERAL_CHARS:
+                self._buffer.append(char)
+                return True
+            try:
+                value = json.loads("".join(self._buffer))
+            except ValueError:
+                return False
+            self._set_value(value)
+            return self._step(char)
+        if state == "nested":
+            self._consume_nested_char(char)
+            return True
+        if char.isspace():
+            return True
+        if state == "key_or_end" and char == '"':
+            self._start_string("key", char)
+        elif state == "key_or_end" and char == "}":
+            self._abandon()
+        elif state == "colon" and char == ":":
+            self._state = "value"
+        elif state == "value" and char == '"':
+            self._start_string("string", char)
+        elif state == "value" and char in "{[":
+            self._state, self._nested_depth, self._escape = "nested", 1, None
+        elif state == "value" and char in LITERAL_CHARS:
+            self._state, self._buffer = "literal", [char]
+        elif state == "comma" and char == ",":
+            self._state = "key_or_end"
+        elif state == "comma" and char == "}":
+            self._abandon()
+        else:
+            return False
+        return True
+
+    def _start_string(self, state, char):
+        self._state, self._buffer, self._escape = state, [char], False
+
+    def _consume_string_char(self, char):
+        """Append a character to the current string, returning True when the string is closed."""
+        self._buffer.append(char)
+        if self._escape:
+            self._escape = False
+        elif char == "\\":
+            self._escape = True
+        elif char == '"':
+            return True
+        return False
+
+    def _consume_nested_char(self, char):
+        # Nested values are skipped; _escape is None outside strings and a bool inside them
+        if self._escape is not None:
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._escape = None
+        elif char == '"':
+            self._escape = False
+        elif char in "{[":
+            self._nested_depth += 1
+        elif char in "}]":
+            self._nested_depth -= 1
+            if self._nested_depth == 0:
+                self._state = "comma"
+
+    def _set_value(self, value):
+        # Models often answer null for a sub request type that does not apply
+        if value is None and self._key in self.required_fields:
+            value = ""
+        self.fields[self._key] = value
+        self._key, self._state = None, "comma"
+
+    def _abandon(self):
+        # The object ended or turned out invalid; keep its fields only if they were complete
+        if not self.complete:
+            self.fields = {}
+        self._start, self._state, self._key = None, None, None
+
+
+def _chunk_text(chunk):
+    """Return the JSON text carried by a streamed chunk, preferring tool call arguments."""
+    tool_call_chunks = getattr(chunk, "tool_call_chunks", None)
+    if tool_call_chunks:
+        return "".join(tool_chunk.get("args") or "" for tool_chunk in tool_call_chunks)
+
+    content = getattr(chunk, "content", chunk)
+    if isinstance(content, list):
+        return "".join(part if isinstance(part, str) else part.get("text", "") for part in content)
+    return content if isinstance(content, str) else ""
+
+
+def bind_classification_schema(model, mapping):
+    """Bind the classification schema as a forced tool call, falling back to the plain model."""
+    schema = build_classification_schema(mapping)
+    try:
+        return model.bind_tools([schema], tool_choice=CLASSIFICATION_TOOL_NAME)
+    except (AttributeError, NotImplementedError, TypeError):
+        return model
+
+
+def stream_classification(model, messages, mapping, required_fields=REQUIRED_FIELDS):
+    """
+    Stream a structured classification from the model and stop as soon as the required fields,
+    by default request_type and sub_request_type, are complete. The result is validated against the mapping.
+    """
+    parser = StreamingJSONParser(required_fields)
+    stream = bind_classification_schema(model, mapping).stream(messages)
+    try:
+        for chunk in stream:
+            if parser.feed(_chunk_text(chunk)):
+                break
+    finally:
+        close = getattr(stream, "close", None)
+        if close:
+            close()
+
+    if not parser.complete:
+        raise ValueError(f"Model response did not contain {', '.join(required_fields)}")
+    return validate_classification(dict(parser.fields), mapping)
@@ -12,4 +12,16 @@ DB_PORT = os.getenv("DB_PORT", "5432")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 HUGGINGFACE_API_KEY = os.getenv("HUGGINGFACE_API_KEY")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
\ No newline at end of file
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+REQUEST_SUBREQUEST_MAP = {
+    "Adjustment": [],
+    "AU Transfer": [],
+    "Closing Notice": ["Reallocation Fees", "Amendment Fees", "Reallocation Principal"],
+    "Commitment Change": ["Cashless Roll", "Decrease", "Increase"],
+    "Fee Payment": ["Ongoing Fee", "Letter of Credit Fee"],
+    "Money Movement-Inbound": ["Principal", "Interest", "Principal+Interest", "Principal+Interest+Fee"],
+    "Money Movement-Outbound": ["Timebound", "Foreign Currency"]
+}
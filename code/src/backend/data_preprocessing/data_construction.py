@@ -3,10 +3,12 @@ from langchain_core.messages import SystemMessage, HumanMessage
 import json
 import re
 import logging
+from classifier.structured_output import stream_classification
 
-def data_construction_func(model, mapping, file_path):
+def data_construction_func(model, mapping, file_path, structured=False):
     """
     Uses an LLM to extract request_type and sub_request_type from text.
+    With structured=True the answer is streamed against a JSON schema built from the mapping.
     """
     text_from_file = extract_text(file_path)
     
@@ -19,13 +21,18 @@ def data_construction_func(model, mapping, file_path):
     Respond in JSON with request_type and sub_request_type keys and it's corresponding values.
     """
 
+    messages = [
+        SystemMessage(content="You are an expert in document classification."),
+        HumanMessage(content=prompt)
+    ]
+
     try:
-        response = model.invoke(
-            input=[
-                SystemMessage(content="You are an expert in document classification."),
-                HumanMessage(content=prompt)
-            ]
-        )
+        if structured:
+            response_dict = stream_classification(model, messages, mapping)
+            response_dict['text']=text_from_file
+            return response_dict
+
+        response = model.invoke(input=messages)
 
         result=response.content
         result=re.search(r'\{\s*\"request_type\":.*?\}', result, re.DOTALL).group(0)
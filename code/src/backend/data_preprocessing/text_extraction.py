@@ -5,6 +5,8 @@ from msg_parser import MsOxMessage
 from data_preprocessing.data_cleaning import clean_text
 import os
 
+EXTRACTION_ERROR_PREFIX = "Error in extracting text"
+
 def extract_text_from_pdf(pdf_path):
     """Extract raw text from a PDF file."""
     try:
@@ -32,21 +34,18 @@ def extract_text_from_txt(txt_path):
     except Exception as e:
         return "Error in extracting text from TXT"
 
+def format_email_text(parser):
+    """Combine the metadata and plain text body of a parsed email into a single text output."""
+    subject = parser.subject or "No subject"
+    sender = parser.from_[0][1] if parser.from_ else "Unknown sender"
+    recipients = ", ".join([recipient[1] for recipient in parser.to]) if parser.to else "Unknown recipients"
+    body = parser.text_plain[0] if parser.text_plain else "No content in email."
+    return f"Subject: {subject}\nSender: {sender}\nRecipients: {recipients}\n\n{body}"
+
 def extract_text_from_email(email_path):
     """Extract text and metadata from a .email or .eml file using mail-parser."""
     try:
-        parser = MailParser()
-        parser.parse_from_file(email_path)
-
-        # Extract metadata
-        subject = parser.subject or "No subject"
-        sender = parser.from_[0][1] if parser.from_ else "Unknown sender"
-        recipients = ", ".join([recipient[1] for recipient in parser.to]) if parser.to else "Unknown recipients"
-        body = parser.text_plain[0] if parser.text_plain else "No content in email."
-
-        # Combine metadata and body into a single text output
-        text = f"Subject: {subject}\nSender: {sender}\nRecipients: {recipients}\n\n{body}"
-        return text
+        return format_email_text(MailParser.from_file(email_path))
     except Exception as e:
         return f"Error in extracting text from email: {str(e)}"
     
@@ -65,6 +64,13 @@ def extract_text_from_msg(msg_path):
     except Exception as e:
         return f"Error in extracting text from MSG: {str(e)}"
 
+def extract_text_from_raw_email(raw_email):
+    """Extract text and metadata from raw email bytes, e.g. a message read from an mbox."""
+    try:
+        return format_email_text(MailParser.from_bytes(raw_email))
+    except Exception as e:
+        return f"Error in extracting text from email: {str(e)}"
+
 def convert_email_to_txt(email_path):
     """Convert .eml, .msg, or .email files to plain text."""
     try:
@@ -98,4 +104,26 @@ def extract_text(file_path):
     else:
         raise ValueError("Unsupported file format")
 
-    return text
\ No newline at end of file
+    return text
+
+def extract_text_from_source(source):
+    """
+    Extract cleaned text from a file path or raw email bytes without writing next to the source.
+    Emails are parsed into their metadata and body, then normalized like every other file.
+    Returns an error message starting with EXTRACTION_ERROR_PREFIX on failure.
+    """
+    if isinstance(source, bytes):
+        text = extract_text_from_raw_email(source)
+    elif source.endswith(".eml") or source.endswith(".email"):
+        text = extract_text_from_email(source)
+    elif source.endswith(".msg"):
+        text = extract_text_from_msg(source)
+    else:
+        try:
+            return extract_text(source)
+        except ValueError as e:
+            return f"{EXTRACTION_ERROR_PREFIX}: {str(e)}"
+
+    if text.startswith(EXTRACTION_ERROR_PREFIX):
+        return text
+    return clean_text(text)
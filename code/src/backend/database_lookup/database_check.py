@@ -1,14 +1,18 @@
 import logging
+from functools import lru_cache
 import psycopg2
+from psycopg2.extras import execute_values
 from sentence_transformers import SentenceTransformer, util
 import numpy as np
 from data_preprocessing.data_construction import data_construction_func
-from config import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+from config import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, EMBEDDING_MODEL
 from utils import list_files_in_dir
 
 
-# Load embedding model
-embed_model = SentenceTransformer("all-MiniLM-L6-v2")
+@lru_cache(maxsize=None)
+def get_embed_model():
+    """Load the embedding model on first use, so importing this module stays cheap."""
+    return SentenceTransformer(EMBEDDING_MODEL)
 
 def get_db_connection():
     return psycopg2.connect(
@@ -44,11 +48,13 @@ def provide_context(model, mapping, look_for_sample_dataset=True):
     
     if look_for_sample_dataset:
         for x in list_files_in_dir("sample_dataset"):
-            result = data_construction_func(model, mapping, x)
-            if "error" in result:
-                return f"Rate limit exceeded. Details: {result['details']}."
+            result = data_construction_func(model, mapping, x, structured=True)
+            if "retry_after" in result:
+                return f"Rate limit exceeded. Retry after {result['retry_after']} seconds."
+            elif "error" in result:
+                logging.warning(f"Skipping sample {x}: {result.get('details', result['error'])}")
             else:
-                context.append(data_construction_func(model, mapping, x))
+                context.append(result)
         
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -72,6 +78,7 @@ def find_similar_request(text, threshold=0.7):
     cursor.execute("SELECT text, request_type, sub_request_type FROM requests")
     past_requests = cursor.fetchall()
 
+    embed_model = get_embed_model()
     text_embedding = embed_model.encode(text, convert_to_tensor=True)
 
     best_match = None
@@ -105,4 +112,122 @@ def fed_data_into_db(text, request_type, sub_request_type):
         return True
     except Exception as e:
         logging.error(f"Error: {e}")
-        return False
\ No newline at end of file
+        return False
+
+def embed_texts(texts, batch_size=256):
+    """Encode texts in batches into normalized embeddings."""
+    return get_embed_model().encode(texts, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True)
+
+def add_embedding_columns():
+    logging.info("Adding embedding columns to requests table...")
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    cursor.execute("""
+    ALTER TABLE requests
+        ADD COLUMN IF NOT EXISTS embedding REAL[],
+        ADD COLUMN IF NOT EXISTS embedding_model VARCHAR(255),
+        ADD COLUMN IF NOT EXISTS source_id TEXT;
+    CREATE UNIQUE INDEX IF NOT EXISTS requests_source_id_idx ON requests (source_id);
+    CREATE INDEX IF NOT EXISTS requests_embedding_model_idx ON requests (embedding_model);
+    CREATE INDEX IF NOT EXISTS requests_request_type_idx ON requests (request_type, sub_request_type);
+    """)
+
+    conn.commit()
+    cursor.close()
+    conn.close()
+    logging.info("Embedding columns added successfully.")
+
+def fetch_labelled_embeddings(embedding_model=EMBEDDING_MODEL):
+    """Fetch request types and embeddings of past requests embedded with the given model."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT request_type, sub_request_type, embedding FROM requests WHERE embedding_model = %s AND embedding IS NOT NULL",
+        (embedding_model,)
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    return rows
+
+def fetch_loaded_source_ids():
+    """Fetch the source ids of requests loaded by a backfill, which a resumed run skips."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT source_id FROM requests WHERE source_id IS NOT NULL")
+    source_ids = {row[0] for row in cursor.fetchall()}
+    cursor.close()
+    conn.close()
+    return source_ids
+
+def fetch_requests_after(last_id, limit):
+    """Fetch the next page of (id, text) rows ordered by id, for resumable reindexing."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, text FROM requests WHERE id > %s ORDER BY id LIMIT %s", (last_id, limit))
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    return rows
+
+def bulk_insert_requests(rows, page_size=1000):
+    """
+    Insert (text, request_type, sub_request_type, embedding, embedding_model, source_id) rows in one transaction.
+    Rows whose source_id is already stored are skipped, so reloading a batch is harmless.
+    """
+    try:
+        logging.info(f"Bulk loading {len(rows)} requests into the database...")
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        execute_values(
+            cursor,
+            "INSERT INTO requests (text, request_type, sub_request_type, embedding, embedding_model, source_id) VALUES %s "
+            "ON CONFLICT (source_id) DO NOTHING",
+            rows,
+            page_size=page_size
+        )
+        conn.commit()
+        cursor.close()
+        conn.close()
+        logging.info("Requests bulk loaded successfully.")
+        return True
+    except Exception as e:
+        logging.error(f"Error: {e}")
+        return False
+
+def update_request_embeddings(rows, embedding_model=EMBEDDING_MODEL, page_size=1000):
+    """Replace the embeddings of existing requests from (id, embedding) rows in one transaction."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        execute_values(
+            cursor,
+            """
+            UPDATE requests SET embedding = data.embedding, embedding_model = data.embedding_model
+            FROM (VALUES %s) AS data (id, embedding, embedding_model)
+            WHERE requests.id = data.id
+            """,
+            [(request_id, embedding, embedding_model) for request_id, embedding in rows],
+            template="(%s, %s::REAL[], %s)",
+            page_size=page_size
+        )
+        conn.commit()
+        cursor.close()
+        conn.close()
+        return True
+    except Exception as e:
+        logging.error(f"Error: {e}")
+        return False
+
+def reindex_requests_table():
+    logging.info("Rebuilding indexes on requests table...")
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("REINDEX TABLE requests")
+    conn.commit()
+    cursor.close()
+    conn.close()
+    logging.info("Indexes rebuilt successfully.")
@@ -6,6 +6,7 @@ from data_preprocessing.text_extraction import extract_text
 from database_lookup.database_check import create_requests_table, fed_data_into_db, find_similar_request, provide_context
 from models import openai_llm, deepseek_llm, huggingface_zephyr_llm, gemini_llm
 from classifier.llm_classifier import call_llm
+from config import REQUEST_SUBREQUEST_MAP
 import os
 import shutil
 
@@ -30,17 +31,6 @@ app.add_middleware(
 )
 
 
-REQUEST_SUBREQUEST_MAP = {
-    "Adjustment": [],
-    "AU Transfer": [],
-    "Closing Notice": ["Reallocation Fees", "Amendment Fees", "Reallocation Principal"],
-    "Commitment Change": ["Cashless Roll", "Decrease", "Increase"],
-    "Fee Payment": ["Ongoing Fee", "Letter of Credit Fee"],
-    "Money Movement-Inbound": ["Principal", "Interest", "Principal+Interest", "Principal+Interest+Fee"],
-    "Money Movement-Outbound": ["Timebound", "Foreign Currency"]
-}
-
-
 @app.post("/classify")
 async def classify_request(email: UploadFile = File(...), attachments: List[UploadFile] = File(None)):
     try:
@@ -89,7 +79,8 @@ async def classify_request(email: UploadFile = File(...), attachments: List[Uplo
         # Call LLM
         if not similar_case:
             logging.info("No similar case found, calling LLM for classification")
-            llm_result = call_llm(model=model, text=extracted_text, allowed_types=REQUEST_SUBREQUEST_MAP, similar_cases=context)
+            llm_result = call_llm(model=model, text=extracted_text, allowed_types=REQUEST_SUBREQUEST_MAP, similar_cases=context, structured=True,
+                                  required_fields=("request_type", "sub_request_type", "reasoning"))
 
             if "error" in llm_result:
                 return {"Error": llm_result["error"]}
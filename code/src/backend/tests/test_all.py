@@ -2,7 +2,7 @@ import pytest
 from unittest.mock import patch, MagicMock
 import psycopg2
 from data_preprocessing.data_cleaning import clean_text
-from data_preprocessing.text_extraction import extract_text
+from data_preprocessing.text_extraction import extract_text, extract_text_from_raw_email, extract_text_from_source
 from data_preprocessing.data_construction import data_construction_func
 from database_lookup.database_check import (
     get_db_connection,
@@ -10,8 +10,14 @@ from database_lookup.database_check import (
     provide_context,
     find_similar_request,
     fed_data_into_db,
+    bulk_insert_requests,
 )
 from classifier.llm_classifier import call_llm
+from classifier.structured_output import StreamingJSONParser, build_classification_schema
+from concurrent.futures import ThreadPoolExecutor
+import os
+from backfill import backfill, classify_unlabelled, iter_source_items, label_from_similar, load_checkpoint, reindex, save_checkpoint
+import numpy as np
 
 
 @patch("database_lookup.database_check.psycopg2.connect")
@@ -59,13 +65,14 @@ def test_provide_context(mock_data_construction_func, mock_list_files_in_dir, mo
     mock_conn.cursor.return_value = mock_cursor
     mock_cursor.fetchall.return_value = [("text1", "type1", "subtype1")]
     mock_list_files_in_dir.return_value = ["file1", "file2"]
-    mock_data_construction_func.side_effect = lambda model, mapping, x: {"file": x}
+    mock_data_construction_func.side_effect = lambda model, mapping, x, structured: {"file": x}
 
     context = provide_context("model", "mapping", look_for_sample_dataset=True)
 
     mock_list_files_in_dir.assert_called_once_with("sample_dataset")
-    mock_data_construction_func.assert_any_call("model", "mapping", "file1")
-    mock_data_construction_func.assert_any_call("model", "mapping", "file2")
+    mock_data_construction_func.assert_any_call("model", "mapping", "file1", structured=True)
+    mock_data_construction_func.assert_any_call("model", "mapping", "file2", structured=True)
+    assert mock_data_construction_func.call_count == 2
     mock_get_db_connection.assert_called_once()
     mock_conn.cursor.assert_called_once()
     mock_cursor.execute.assert_called_once_with("SELECT text, request_type, sub_request_type FROM requests")
@@ -195,4 +202,254 @@ def test_call_llm(mock_re_search, mock_json_loads, mock_human_message, mock_syst
     mock_model = MagicMock()
     result = call_llm(mock_model, "test text", {"Money Movement": ["Inbound"]}, [])
     assert result["request_type"] == "Money Movement"
-    assert result["sub_request_type"] == "Inbound"
\ No newline at end of file
+    assert result["sub_request_type"] == "Inbound"
+
+
+class StubStreamingProvider:
+    """Stub chat model that streams tool call argument chunks and records how many were consumed."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.consumed = 0
+        self.bound_tools = None
+
+    def bind_tools(self, tools, tool_choice=None):
+        self.bound_tools = tools
+        return self
+
+    def stream(self, messages):
+        for args in self.chunks:
+            self.consumed += 1
+            yield MagicMock(tool_call_chunks=[{"args": args}])
+
+
+def test_streaming_json_parser_ignores_braces_in_reasoning():
+    parser = StreamingJSONParser()
+    assert not parser.feed('Thinking {about it}... {"reasoning": "a {tricky} \\"case\\"", "sub_request_')
+    assert parser.feed('type": "Inbound", "request_type": "Money Movement"')
+    assert parser.fields["request_type"] == "Money Movement"
+    assert parser.fields["sub_request_type"] == "Inbound"
+
+
+def test_call_llm_structured_stops_streaming_early():
+    mapping = {"Money Movement": ["Inbound"], "Adjustment": []}
+    provider = StubStreamingProvider(['{"request_type": "Money', ' Movement", "sub_request_type": "Inbound"', ', "reasoning": "never read"}'])
+    result = call_llm(provider, "test text", mapping, [], structured=True)
+    assert result == {"request_type": "Money Movement", "sub_request_type": "Inbound"}
+    assert provider.consumed == 2
+    assert provider.bound_tools == [build_classification_schema(mapping)]
+
+
+def test_streaming_json_parser_recovers_from_unbalanced_preamble():
+    parser = StreamingJSONParser()
+    assert parser.feed('Use {x to decide. {"request_type": "A", "sub_request_type": "B"}')
+    assert parser.fields == {"request_type": "A", "sub_request_type": "B"}
+
+    parser = StreamingJSONParser()
+    assert not parser.feed('I think {it\'s "weird} ok {"request_type": "A", ')
+    assert parser.feed('"sub_request_type": "B"}')
+    assert parser.fields == {"request_type": "A", "sub_request_type": "B"}
+
+
+def test_call_llm_structured_accepts_null_sub_request_type():
+    mapping = {"Adjustment": [], "AU Transfer": []}
+    provider = StubStreamingProvider(['{"request_type": "Adjustment", "sub_request_type": nu', 'll, "reasoning": "never read"}'])
+    result = call_llm(provider, "test text", mapping, [], structured=True)
+    assert result == {"request_type": "Adjustment", "sub_request_type": ""}
+
+
+@patch("data_preprocessing.data_construction.extract_text")
+def test_data_construction_func_structured(mock_extract_text):
+    mock_extract_text.return_value = "Sample text"
+    mapping = {"Money Movement": ["Inbound"]}
+    provider = StubStreamingProvider(['Sure {see below}: {"request_type": "Money Movement", ', '"sub_request_type": "Inbound"}'])
+    result = data_construction_func(provider, mapping, "sample.txt", structured=True)
+    assert result == {"request_type": "Money Movement", "sub_request_type": "Inbound", "text": "Sample text"}
+    assert provider.bound_tools == [build_classification_schema(mapping)]
+
+
+def test_call_llm_structured_waits_for_required_fields():
+    mapping = {"Money Movement": ["Inbound"]}
+    provider = StubStreamingProvider(['{"request_type": "Money Movement", "sub_request_type": "Inbound"', ', "reasoning": "Funds received"}', 'never read'])
+    result = call_llm(provider, "test text", mapping, [], structured=True,
+                      required_fields=("request_type", "sub_request_type", "reasoning"))
+    assert result == {"request_type": "Money Movement", "sub_request_type": "Inbound", "reasoning": "Funds received"}
+    assert provider.consumed == 2
+
+
+def test_call_llm_structured_rejects_unknown_types():
+    mapping = {"Money Movement": ["Inbound"]}
+    provider = StubStreamingProvider(['{"request_type": "Money Movement", "sub_request_type": "Outbound"}'])
+    result = call_llm(provider, "test text", mapping, [], structured=True)
+    assert "error" in result
+    assert "Outbound" in result["details"]
+
+
+@patch("database_lookup.database_check.execute_values")
+@patch("database_lookup.database_check.get_db_connection")
+def test_bulk_insert_requests(mock_get_db_connection, mock_execute_values):
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_get_db_connection.return_value = mock_conn
+    mock_conn.cursor.return_value = mock_cursor
+    rows = [("test_text", "type1", "subtype1", [0.1, 0.2], "model", "inbox/1.eml")]
+
+    result = bulk_insert_requests(rows)
+
+    mock_execute_values.assert_called_once_with(
+        mock_cursor,
+        "INSERT INTO requests (text, request_type, sub_request_type, embedding, embedding_model, source_id) VALUES %s "
+        "ON CONFLICT (source_id) DO NOTHING",
+        rows,
+        page_size=1000,
+    )
+    mock_conn.commit.assert_called_once()
+    assert result is True
+
+def test_label_from_similar():
+    known_embeddings = np.array([[1.0, 0.0], [0.0, 1.0]])
+    known_labels = [("type1", "subtype1"), ("type2", "")]
+    embeddings = np.array([[0.0, 1.0], [0.6, 0.8]])
+
+    labels = label_from_similar(embeddings, known_embeddings, known_labels, threshold=0.9)
+
+    assert labels == [("type2", ""), None]
+    assert label_from_similar(embeddings, np.empty((0, 2)), [], threshold=0.9) == [None, None]
+
+def test_iter_source_items_uses_resolved_paths(tmp_path, monkeypatch):
+    mbox_path = tmp_path / "history.mbox"
+    mbox_path.write_text(
+        "From a@example.com Mon Jan  1 00:00:00 2024\nSubject: First\n\nFee payment\n\n"
+        "From b@example.com Mon Jan  1 00:00:00 2024\nSubject: Second\n\nCommitment increase\n"
+    )
+    resolved = os.path.realpath(mbox_path)
+    monkeypatch.chdir(tmp_path)
+
+    items = list(iter_source_items("history.mbox"))
+
+    assert [item_id for item_id, _ in items] == [f"{resolved}:0", f"{resolved}:1"]
+    assert b"Commitment increase" in items[1][1]
+    assert [item_id for item_id, _ in iter_source_items(str(mbox_path))] == [f"{resolved}:0", f"{resolved}:1"]
+
+def test_extract_text_from_raw_email():
+    raw_email = (
+        b"From: a@example.com\r\nTo: b@example.com\r\nSubject: Fee\r\n"
+        b"DKIM-Signature: v=1; a=rsa-sha256; b=abc123\r\nContent-Type: text/plain\r\n\r\nPlease pay the ongoing fee.\r\n"
+    )
+
+    text = extract_text_from_raw_email(raw_email)
+
+    assert text.startswith("Subject: Fee\nSender: a@example.com\nRecipients: b@example.com\n\n")
+    assert "Please pay the ongoing fee." in text
+    assert "DKIM" not in text
+
+@patch("backfill.time.sleep")
+@patch("backfill.call_llm")
+def test_classify_unlabelled_retries_rate_limits(mock_call_llm, mock_sleep):
+    mock_call_llm.side_effect = [
+        {"error": "Rate limit exceeded", "retry_after": 7},
+        {"request_type": "Fee Payment", "sub_request_type": "Ongoing Fee"},
+    ]
+
+    results = classify_unlabelled("model", ["fee"], [], max_concurrency=1)
+
+    assert results == [{"request_type": "Fee Payment", "sub_request_type": "Ongoing Fee"}]
+    mock_sleep.assert_called_once_with(7)
+    assert mock_call_llm.call_count == 2
+
+BACKFILL_EMBEDDINGS = {"fee": [1.0, 0.0], "increase": [0.0, 1.0], "decrease": [0.0, -1.0]}
+
+@patch("backfill.ProcessPoolExecutor", lambda max_workers, mp_context: ThreadPoolExecutor(max_workers=1))
+@patch("backfill.bulk_insert_requests")
+@patch("backfill.call_llm")
+@patch("backfill.provide_context", return_value=[])
+@patch("backfill.embed_texts", side_effect=lambda texts, batch_size: np.array([BACKFILL_EMBEDDINGS[t] for t in texts]))
+@patch("backfill.fetch_loaded_source_ids")
+@patch("backfill.fetch_labelled_embeddings", return_value=[("Fee Payment", "Ongoing Fee", [1.0, 0.0])])
+@patch("backfill.add_embedding_columns")
+@patch("backfill.create_requests_table")
+def test_backfill_resumes_from_loaded_source_ids(mock_create, mock_add_columns, mock_fetch, mock_loaded, mock_embed,
+                                                 mock_context, mock_call_llm, mock_bulk_insert, tmp_path):
+    source = tmp_path / "mailbox"
+    source.mkdir()
+    for name in ["fee", "increase", "decrease"]:
+        (source / f"{name}.txt").write_text(name)
+    (source / "broken.pdf").write_bytes(b"not a pdf")
+    source = os.path.realpath(source)
+    mock_loaded.return_value = set()
+    mock_bulk_insert.return_value = True
+    mock_call_llm.side_effect = lambda text, **kwargs: (
+        {"request_type": "Commitment Change", "sub_request_type": "Increase"} if text == "increase"
+        else {"error": "An unexpected error occurred", "details": "boom"}
+    )
+
+    # One failed extraction and one failed classification are left pending
+    assert backfill("model", source) == 2
+
+    # "fee" reuses the label of the known similar request, so only the others reach the LLM
+    assert sorted(call.kwargs["text"] for call in mock_call_llm.call_args_list) == ["decrease", "increase"]
+    rows = mock_bulk_insert.call_args[0][0]
+    assert [(row[0], row[1], row[2], row[5]) for row in rows] == [
+        ("fee", "Fee Payment", "Ongoing Fee", os.path.join(source, "fee.txt")),
+        ("increase", "Commitment Change", "Increase", os.path.join(source, "increase.txt")),
+    ]
+    assert sorted(os.listdir(source)) == ["broken.pdf", "decrease.txt", "fee.txt", "increase.txt"]
+
+    mock_loaded.return_value = {row[5] for row in rows}
+    mock_call_llm.reset_mock()
+    mock_bulk_insert.reset_mock()
+    mock_call_llm.side_effect = None
+    mock_call_llm.return_value = {"request_type": "Commitment Change", "sub_request_type": "Decrease"}
+
+    # Loaded items are skipped; the failed classification is retried and the failed extraction tried again
+    assert backfill("model", source) == 1
+    assert [call.kwargs["text"] for call in mock_call_llm.call_args_list] == ["decrease"]
+    assert [row[0] for row in mock_bulk_insert.call_args[0][0]] == ["decrease"]
+
+@patch("backfill.reindex_requests_table")
+@patch("backfill.update_request_embeddings", return_value=True)
+@patch("backfill.embed_texts", side_effect=lambda texts, batch_size: np.ones((len(texts), 2)))
+@patch("backfill.fetch_requests_after")
+@patch("backfill.add_embedding_columns")
+def test_reindex_resumes_and_resets_checkpoint(mock_add_columns, mock_fetch, mock_embed, mock_update, mock_reindex, tmp_path):
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    save_checkpoint(checkpoint_path, {"reindex_last_id": 5})
+    mock_fetch.side_effect = [[(6, "text6"), (7, "text7")], [(9, "text9")], []]
+
+    reindex(checkpoint_path, batch_size=2)
+
+    assert [call.args for call in mock_fetch.call_args_list] == [(5, 2), (7, 2), (9, 2)]
+    assert [request_id for call in mock_update.call_args_list for request_id, _ in call.args[0]] == [6, 7, 9]
+    mock_reindex.assert_called_once()
+    assert load_checkpoint(checkpoint_path) == {"reindex_last_id": 0}
+
+@patch("database_lookup.database_check.get_db_connection")
+@patch("database_lookup.database_check.list_files_in_dir")
+@patch("database_lookup.database_check.data_construction_func")
+def test_provide_context_skips_invalid_samples(mock_data_construction_func, mock_list_files_in_dir, mock_get_db_connection):
+    mock_get_db_connection.return_value.cursor.return_value.fetchall.return_value = []
+    mock_list_files_in_dir.return_value = ["file1", "file2"]
+    mock_data_construction_func.side_effect = [
+        {"error": "An unexpected error occurred", "details": "Request type 'Other' is not an allowed request type"},
+        {"request_type": "Adjustment", "sub_request_type": "", "text": "text2"},
+    ]
+
+    context = provide_context("model", "mapping", look_for_sample_dataset=True)
+
+    assert context == [{"request_type": "Adjustment", "sub_request_type": "", "text": "text2"}]
+
+    mock_data_construction_func.side_effect = [{"error": "Rate limit exceeded", "retry_after": 30}]
+    assert provide_context("model", "mapping", look_for_sample_dataset=True) == "Rate limit exceeded. Retry after 30 seconds."
+
+def test_extract_text_from_source_parses_email_files_in_place(tmp_path):
+    email_path = tmp_path / "notice.eml"
+    email_path.write_bytes(
+        b"From: a@example.com\r\nTo: b@example.com\r\nSubject: Fee!\r\n"
+        b"Content-Type: text/plain\r\n\r\nPlease pay the ongoing fee.\r\n"
+    )
+
+    text = extract_text_from_source(str(email_path))
+
+    assert text == extract_text_from_source(email_path.read_bytes())
+    assert text == "subject fee sender aexample.com recipients bexample.com please pay the ongoing fee."
+    assert os.listdir(tmp_path) == ["notice.eml"]